@@ -0,0 +1,222 @@
+import os
+import functools
+import orjson
+import numpy as np
+from datetime import datetime, timezone
+from skyfield.api import load
+from skyfield.sgp4lib import theta_GMST1982
+from sgp4.api import SGP4_ERRORS
+
+# numba необязателен: без него пролеты ищутся средствами NumPy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# CelesTrak просит не запрашивать один и тот же TLE чаще нескольких раз в сутки;
+# файл tle-{norad_id}.txt общий для обоих скриптов
+TLE_CACHE_MAX_AGE_SEC = 6 * 3600
+
+# orjson пишет UTF-8 и умеет сериализовать значения NumPy
+JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+
+# Строк эфемерид в одной порции записи JSON Lines
+JSON_LINES_CHUNK = 10000
+
+# Эллипсоид WGS84
+WGS84_RADIUS_KM = 6378.137
+WGS84_FLATTENING = 1 / 298.257223563
+WGS84_E2 = 2 * WGS84_FLATTENING - WGS84_FLATTENING ** 2
+
+# Угловая скорость вращения Земли
+EARTH_ROTATION_RAD_PER_SEC = 7.2921150e-5
+
+@functools.lru_cache(maxsize=1)
+def get_timescale():
+    # Встроенные в skyfield таблицы секунд координации и delta T:
+    # без сети и с разбором только при первом вызове
+    return load.timescale(builtin=True)
+
+def teme_to_itrf(r_teme, jd_ut1, fraction_ut1):
+    # Поворот TEME -> ITRF на гринвичское среднее звездное время (GMST 1982),
+    # движение полюса не учитывается
+    theta, _ = theta_GMST1982(jd_ut1, fraction_ut1)
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    x, y, z = r_teme.T
+    return np.array([cos_theta * x + sin_theta * y, cos_theta * y - sin_theta * x, z])
+
+def itrf_to_geodetic(r_itrf):
+    # Геодезические широта, долгота и высота над эллипсоидом WGS84
+    x, y, z = r_itrf
+    R = np.hypot(x, y)
+    lat = np.arctan2(z, R)
+    for _ in range(3):
+        sin_lat = np.sin(lat)
+        aC = WGS84_RADIUS_KM / np.sqrt(1.0 - WGS84_E2 * sin_lat * sin_lat)
+        hyp = z + aC * WGS84_E2 * sin_lat
+        lat = np.arctan2(hyp, R)
+    height_km = np.sqrt(hyp * hyp + R * R) - aC
+    return np.degrees(lat), np.degrees(np.arctan2(y, x)), height_km
+
+def quantize(values, scale, dtype=np.int32):
+    # Фиксированная точка: значение столбца = целое / scale
+    return np.round(values * scale).astype(dtype)
+
+def detect_passes_numpy(alt_deg, min_elevation):
+    # Границы пролетов по маске видимости; максимум по отрезкам от начала
+    # одного пролета до начала следующего совпадает с максимумом пролета,
+    # так как шаги между пролетами ниже порога
+    visible = alt_deg >= min_elevation
+    edges = np.diff(np.concatenate(([False], visible, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends, np.maximum.reduceat(alt_deg, starts)
+
+def scan_passes(alt_deg, min_elevation):
+    # То же одним проходом без промежуточных массивов; имеет смысл
+    # только в скомпилированном numba виде
+    n = alt_deg.size
+    starts = np.empty(n // 2 + 1, dtype=np.int64)
+    ends = np.empty(n // 2 + 1, dtype=np.int64)
+    max_elevation = np.empty(n // 2 + 1, dtype=np.float64)
+    count = 0
+    in_pass = False
+    for i in range(n):
+        if alt_deg[i] >= min_elevation:
+            if not in_pass:
+                in_pass = True
+                starts[count] = i
+                max_elevation[count] = alt_deg[i]
+            elif alt_deg[i] > max_elevation[count]:
+                max_elevation[count] = alt_deg[i]
+        elif in_pass:
+            in_pass = False
+            ends[count] = i
+            count += 1
+    if in_pass:
+        ends[count] = n
+        count += 1
+    return starts[:count], ends[:count], max_elevation[:count]
+
+detect_passes = njit(cache=True)(scan_passes) if njit is not None else detect_passes_numpy
+
+def write_json_lines(path, metadata, columns):
+    # Метаданные и порядок столбцов пишутся в соседний <имя>.meta.json,
+    # сами столбцы - построчно, по массиву значений на строку. Строки
+    # собираются порциями, так что память не растет с длиной интервала
+    with open(os.path.splitext(path)[0] + '.meta.json', 'wb') as f:
+        f.write(orjson.dumps({**metadata, "columns": list(columns)}, option=JSON_OPTIONS))
+
+    row_count = len(next(iter(columns.values())))
+    with open(path, 'wb') as f:
+        for i in range(0, row_count, JSON_LINES_CHUNK):
+            chunk = [column[i:i + JSON_LINES_CHUNK] for column in columns.values()]
+            chunk = [part.tolist() if isinstance(part, np.ndarray) else part for part in chunk]
+            f.write(b''.join(orjson.dumps(row) + b'\n' for row in zip(*chunk)))
+
+def propagate_and_detect_passes(
+    satellite,
+    observer,
+    start_time_utc: datetime,
+    end_time_utc: datetime,
+    step_seconds: int,
+    min_elevation: float,
+    light_time_correction: bool = False
+):
+    # Общее ядро расчета: возвращает столбцы пролетов и столбцы эфемерид
+    # видимых шагов, а оформление вывода остается за вызывающим кодом
+    ts = get_timescale()
+
+    # Как и skyfield, время без часового пояса не трактуется как местное
+    if start_time_utc.tzinfo is None or end_time_utc.tzinfo is None:
+        raise ValueError("cannot interpret a datetime that lacks a timezone")
+
+    # Сетка моментов времени для всего интервала
+    step_count = int((end_time_utc - start_time_utc).total_seconds() // step_seconds) + 1
+    start_utc = start_time_utc.astimezone(timezone.utc)
+    offsets_sec = np.arange(step_count) * step_seconds
+    times = (
+        np.datetime64(start_utc.replace(tzinfo=None), 'us') +
+        (offsets_sec * 10**6).astype('timedelta64[us]')
+    )
+    iso_unit = 's' if start_utc.microsecond == 0 else 'us'
+    t = ts.utc(start_utc.year, start_utc.month, start_utc.day, start_utc.hour, start_utc.minute,
+               start_utc.second + start_utc.microsecond / 1e6 + offsets_sec)
+
+    # SGP4 для всей сетки одним вызовом скомпилированного ядра, минуя
+    # EarthSatellite.at(); юлианские даты UTC берутся из той же сетки
+    days = (times - np.datetime64('1970-01-01', 'us')) / np.timedelta64(1, 'D')
+    jd = 2440587.5 + np.floor(days)
+    fr = days - np.floor(days)
+    sgp4_errors, r_teme, _ = satellite.model.sgp4_array(jd, fr)
+
+    # Шаги, на которых SGP4 не сошелся, пропускаются; сообщение одно
+    # на весь расчет, с первой ошибкой как примером
+    valid = sgp4_errors == 0
+    if not valid.all():
+        first = np.flatnonzero(~valid)[0]
+        print(f"Пропущено шагов с ошибкой SGP4: {np.count_nonzero(~valid)} "
+              f"(первый {times[first]}: {SGP4_ERRORS[sgp4_errors[first]]})")
+
+    times = times[valid]
+    r_sat = teme_to_itrf(r_teme[valid], t.whole[valid], t.ut1_fraction[valid])
+
+    # Станция неподвижна в ITRF: ее координаты и поворот в локальную
+    # систему восток-север-зенит считаются один раз
+    lat, lon = observer.latitude.radians, observer.longitude.radians
+    enu_rotation = np.array([
+        [-np.sin(lon), np.cos(lon), 0.0],
+        [-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)],
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    ])
+    observer_xyz = observer.itrs_xyz.km[:, None]
+
+    if light_time_correction:
+        # Станция берется в момент t - d/c, то есть повернутой вместе
+        # с Землей назад на угол ω·d/c
+        light_time_sec = np.linalg.norm(r_sat, axis=0) / 299792.458
+        angle = EARTH_ROTATION_RAD_PER_SEC * light_time_sec
+        cos_angle, sin_angle = np.cos(angle), np.sin(angle)
+        x0, y0, z0 = observer_xyz[:, 0]
+        observer_xyz = np.array([
+            cos_angle * x0 + sin_angle * y0,
+            cos_angle * y0 - sin_angle * x0,
+            np.full_like(angle, z0)
+        ])
+
+    difference = r_sat - observer_xyz
+    east, north, up = enu_rotation @ difference
+    dist_km = np.linalg.norm(difference, axis=0)
+    alt_deg = np.degrees(np.arcsin(up / dist_km))
+    az_deg = np.degrees(np.arctan2(east, north)) % 360.0
+
+    sub_lat_deg, sub_lon_deg, sub_elev_km = itrf_to_geodetic(r_sat)
+
+    # Пролеты: начала, концы (не включая) и максимальные углы места
+    starts, ends, max_elevation = detect_passes(alt_deg, min_elevation)
+    visible_idx = np.flatnonzero(alt_deg >= min_elevation)
+    pass_ids = np.repeat(np.arange(1, len(starts) + 1), ends - starts)
+
+    # Метки времени видимых шагов форматируются одним вызовом NumPy
+    iso = np.char.add(np.datetime_as_string(times[visible_idx], unit=iso_unit), '+00:00')
+    stamps = dict(zip(visible_idx, iso.tolist()))
+
+    passes = {
+        "start": [stamps[start] for start in starts],
+        "end": [stamps[end - 1] for end in ends],
+        "max_elevation": max_elevation,
+        "duration_sec": (times[ends - 1] - times[starts]) / np.timedelta64(1, 's')
+    }
+
+    ephemeris = {
+        "pass_id": pass_ids,
+        "timestamp": iso.tolist(),
+        "latitude": sub_lat_deg[visible_idx],
+        "longitude": sub_lon_deg[visible_idx],
+        "height_km": sub_elev_km[visible_idx],
+        "elevation": alt_deg[visible_idx],
+        "azimuth": az_deg[visible_idx],
+        "distance_km": dist_km[visible_idx]
+    }
+
+    return passes, ephemeris
@@ -1,24 +1,91 @@
 import os
-import json
+import time
+import orjson
 import requests
-from datetime import datetime, timedelta, timezone
-from skyfield.api import load, wgs84, EarthSatellite
+import numpy as np
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from skyfield.api import wgs84, EarthSatellite
+from sgp4.api import Satrec
+from satellite_core import (
+    JSON_OPTIONS, TLE_CACHE_MAX_AGE_SEC,
+    propagate_and_detect_passes, quantize, write_json_lines
+)
+
+# Имена спутников не меняются, поэтому хранятся без срока давности
+NAMES_CACHE_FILE = "satellite_names.json"
+
+# Эфемериды хранятся целыми числами: значение = целое / масштаб
+EPHEMERIS_SCALE = {
+    'lat': 10**6,
+    'lon': 10**6,
+    'height_m': 100,
+    'elevation': 1000,
+    'azimuth': 1000,
+    'distance_km': 1000
+}
+
+def is_valid_tle(raw_data: str, norad_id: int) -> bool:
+    # Ответ CelesTrak - имя и две строки TLE запрошенного спутника; на
+    # неизвестный номер приходит текст вроде "No GP data found" с кодом 200
+    lines = raw_data.strip().splitlines()
+    if len(lines) < 3 or not lines[1].startswith("1 "):
+        return False
+    try:
+        return Satrec.twoline2rv(lines[1], lines[2]).satnum == norad_id
+    except Exception:
+        return False
 
 def get_satellite_name(norad_id: int) -> str:
+    # Имя уже известно по прошлым запросам
+    names = {}
     try:
-        # Запрос к API
-        url = f"https://celestrak.org/NORAD/elements/gp.php?CATNR={norad_id}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        # Парсинг сырого текста TLE
-        raw_data = response.text
-        if "404 Not Found" in raw_data:
-            return f"SAT-{norad_id}"
+        if os.path.exists(NAMES_CACHE_FILE):
+            with open(NAMES_CACHE_FILE, 'rb') as f:
+                names = orjson.loads(f.read())
+    except Exception as e:
+        # Поврежденный кэш не мешает расчету и будет перезаписан
+        print(f"Ошибка чтения {NAMES_CACHE_FILE}: {str(e)}")
+        names = {}
+    if str(norad_id) in names:
+        return names[str(norad_id)]
+
+    try:
+        cache_file = f"tle-{norad_id}.txt"
+        if (os.path.exists(cache_file) and
+                time.time() - os.path.getmtime(cache_file) < TLE_CACHE_MAX_AGE_SEC):
+            # Свежий TLE уже есть на диске; файл мог записать и второй скрипт,
+            # поэтому содержимое тоже проверяется
+            with open(cache_file, encoding = 'utf-8') as f:
+                raw_data = f.read()
+            if not is_valid_tle(raw_data, norad_id):
+                return f"SAT-{norad_id}"
+        else:
+            # Запрос к API
+            url = f"https://celestrak.org/NORAD/elements/gp.php?CATNR={norad_id}"
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+
+            # Парсинг сырого текста TLE; в кэш попадает только настоящий TLE
+            raw_data = response.text
+            if not is_valid_tle(raw_data, norad_id):
+                return f"SAT-{norad_id}"
+
+            # Файл общий для обоих скриптов и процессов пакетного расчета,
+            # поэтому пишется через временный файл
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding = 'utf-8') as f:
+                f.write(raw_data)
+            os.replace(tmp_file, cache_file)
             
-        lines = raw_data.split('\n')
-        if len(lines) >= 1:
-            return lines[0].strip().split(' ')[0]
+        # Имя из проверенного TLE кэшируется навсегда
+        names[str(norad_id)] = raw_data.strip().splitlines()[0].strip().split(' ')[0]
+        # Запись через временный файл: читатели не увидят файл наполовину
+        tmp_file = f"{NAMES_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(names, option = JSON_OPTIONS))
+        os.replace(tmp_file, NAMES_CACHE_FILE)
+        return names[str(norad_id)]
             
     except Exception as e:
         print(f"Ошибка: {str(e)}")
@@ -36,14 +103,14 @@ def calculate_and_save_data(
     passes_file: str,
     ephemeris_file: str,
     observer_elev: float,
-    min_elevation: float
+    min_elevation: float,
+    satellite_name: str = None
 ) -> None:
-    # Инициализация объектов
+    # Инициализация объектов; сеть нужна только если имя не передано
     satellite = EarthSatellite(tle_line1, tle_line2)
     norad_id = satellite.model.satnum
-    satellite_name = get_satellite_name(norad_id)
+    satellite_name = satellite_name or get_satellite_name(norad_id)
     observer = wgs84.latlon(observer_lat, observer_lon, observer_elev)
-    ts = load.timescale()
 
     # Структуры данных
     common_metadata = {
@@ -62,82 +129,44 @@ def calculate_and_save_data(
         }
     }
 
-    passes_data = []
-    ephemeris_data = []
-    pass_counter = 0
-    current_pass = None
-    current_time = start_time_utc
-
-    while current_time <= end_time_utc:
-        t = ts.from_datetime(current_time)
-       
-        try:
-            # Расчет позиции
-            sat_pos = satellite.at(t)
-            distance_km = sat_pos.distance().km
-            light_time_sec = distance_km / 299792.458
-            t_obs = ts.from_datetime(current_time - timedelta(seconds = light_time_sec))
-           
-            observer_pos = observer.at(t_obs)
-            difference = sat_pos - observer_pos
-            alt, az, distance = difference.altaz()
-           
-            subpoint = sat_pos.subpoint()
-
-        except Exception as e:
-            print(f"Ошибка расчета для времени {current_time}: {str(e)}")
-            current_time += timedelta(seconds = step_seconds)
-            continue
-
-        if alt.degrees >= min_elevation:
-            if not current_pass:
-                pass_counter += 1
-                current_pass = {
-                    'pass_id': pass_counter,
-                    'start': current_time.isoformat(),
-                    'end': current_time.isoformat(),
-                    'max_elevation': alt.degrees,
-                    'duration_sec': 0.0
-                }
-            else:
-                current_pass['end'] = current_time.isoformat()
-                current_pass['max_elevation'] = max(current_pass['max_elevation'], alt.degrees)
-
-            # Добавление эфемерид
-            ephemeris_entry = {
-                'pass_id': pass_counter,
-                'timestamp': current_time.isoformat(),
-                'geodesic': {
-                    'lat': round(subpoint.latitude.degrees, 6),
-                    'lon': round(subpoint.longitude.degrees, 6),
-                    'height_m': round(subpoint.elevation.m, 2)
-                },
-                'relative': {
-                    'elevation': round(alt.degrees, 3),
-                    'azimuth': round(az.degrees, 3),
-                    'distance_km': round(distance.km, 3)
-                }
-            }
-            ephemeris_data.append(ephemeris_entry)
-           
-        elif current_pass:
-            # Фиксация пролета
-            current_pass['duration_sec'] = (
-                datetime.fromisoformat(current_pass['end']) -
-                datetime.fromisoformat(current_pass['start'])
-            ).total_seconds()
-            passes_data.append(current_pass)
-            current_pass = None
-
-        current_time += timedelta(seconds = step_seconds)
-
-    # Фиксация последнего пролета
-    if current_pass:
-        current_pass['duration_sec'] = (
-            datetime.fromisoformat(current_pass['end']) -
-            datetime.fromisoformat(current_pass['start'])
-        ).total_seconds()
-        passes_data.append(current_pass)
+    # Расчет с поправкой на время распространения света
+    passes, ephemeris = propagate_and_detect_passes(
+        satellite, observer,
+        start_time_utc, end_time_utc, step_seconds,
+        min_elevation,
+        light_time_correction = True
+    )
+
+    passes_data = [
+        {
+            'pass_id': pass_id,
+            'start': start,
+            'end': end,
+            'max_elevation': max_elevation,
+            'duration_sec': duration
+        }
+        for pass_id, (start, end, max_elevation, duration) in enumerate(
+            zip(passes['start'], passes['end'],
+                passes['max_elevation'].tolist(), passes['duration_sec'].tolist()),
+            start = 1
+        )
+    ]
+    pass_counter = len(passes_data)
+
+    # Эфемериды видимых шагов по столбцам: имя поля пишется один раз,
+    # а не в каждой записи. Значения округляются до целых в масштабе
+    # EPHEMERIS_SCALE; высота в сантиметрах выходит за int32 уже
+    # для геостационарных орбит, поэтому хранится в int64
+    ephemeris_data = {
+        'pass_id': ephemeris['pass_id'],
+        'timestamp': ephemeris['timestamp'],
+        'lat': quantize(ephemeris['latitude'], EPHEMERIS_SCALE['lat']),
+        'lon': quantize(ephemeris['longitude'], EPHEMERIS_SCALE['lon']),
+        'height_m': quantize(ephemeris['height_km'] * 1000.0, EPHEMERIS_SCALE['height_m'], np.int64),
+        'elevation': quantize(ephemeris['elevation'], EPHEMERIS_SCALE['elevation']),
+        'azimuth': quantize(ephemeris['azimuth'], EPHEMERIS_SCALE['azimuth']),
+        'distance_km': quantize(ephemeris['distance_km'], EPHEMERIS_SCALE['distance_km'])
+    }
 
     passes_output = {
         'metadata': {
@@ -147,17 +176,68 @@ def calculate_and_save_data(
         'passes': passes_data
     }
 
-    ephemeris_output = {
-        'metadata': common_metadata,
-        'ephemeris': ephemeris_data
-    }
+    # Сохранение в файлы; эфемериды - в JSON Lines
+    with open(passes_file, 'wb') as f:
+        f.write(orjson.dumps(passes_output, option = JSON_OPTIONS))
+
+    write_json_lines(
+        ephemeris_file,
+        {
+            **common_metadata,
+            'ephemeris_scale': EPHEMERIS_SCALE
+        },
+        ephemeris_data
+    )
+
+def calculate_batch(
+    tles: list,
+    observer_lat: float,
+    observer_lon: float,
+    start_time_utc: datetime,
+    end_time_utc: datetime,
+    step_seconds: int,
+    passes_file: str,
+    ephemeris_file: str,
+    observer_elev: float,
+    min_elevation: float
+) -> None:
+    # tles - список пар строк TLE; имена файлов задаются шаблоном,
+    # например 'passes_{norad_id}.json'
+    norad_ids = [EarthSatellite(line1, line2).model.satnum for line1, line2 in tles]
+    passes_files = [passes_file.format(norad_id = norad_id) for norad_id in norad_ids]
+    ephemeris_files = [ephemeris_file.format(norad_id = norad_id) for norad_id in norad_ids]
+
+    # Процессы не должны писать в один и тот же файл
+    if len(set(passes_files + ephemeris_files)) != 2 * len(norad_ids):
+        raise ValueError("Файлы спутников совпадают: шаблоны должны содержать {norad_id}, "
+                         "а номера NORAD не повторяться")
 
-    # Сохранение в файлы
-    with open(passes_file, 'w', encoding = 'utf-8') as f:
-        json.dump(passes_output, f, indent = 2, ensure_ascii = False)
+    # Имена спутников запрашиваются по очереди, чтобы не нагружать CelesTrak,
+    # и передаются процессам расчета готовыми
+    names = [get_satellite_name(norad_id) for norad_id in norad_ids]
 
-    with open(ephemeris_file, 'w', encoding = 'utf-8') as f:
-        json.dump(ephemeris_output, f, indent = 2, ensure_ascii = False)
+    # Спутники независимы, поэтому каждый считается в отдельном процессе
+    with ProcessPoolExecutor(max_workers = os.cpu_count()) as pool:
+        futures = [
+            pool.submit(
+                calculate_and_save_data,
+                line1, line2,
+                observer_lat, observer_lon,
+                start_time_utc,
+                end_time_utc,
+                step_seconds,
+                passes_path,
+                ephemeris_path,
+                observer_elev,
+                min_elevation,
+                satellite_name = name
+            )
+            for (line1, line2), passes_path, ephemeris_path, name in zip(
+                tles, passes_files, ephemeris_files, names
+            )
+        ]
+        for future in futures:
+            future.result()
 
 # Для теста
 if __name__ == "__main__":
@@ -175,11 +255,12 @@ if __name__ == "__main__":
         datetime(2023, 10, 1, 12, 0, 0, tzinfo = timezone.utc),
         10,
         'passes.json',
-        'ephemeris.json',
+        'ephemeris.jsonl',
         150,
         min_elevation = 10.0
     )
    
     print("Данные успешно сохранены в файлы:")
     print("- passes.json: информация о пролетах")
-    print("- ephemeris.json: данные эфемерид")
\ No newline at end of file
+    print("- ephemeris.jsonl: данные эфемерид, по строке на шаг")
+    print("- ephemeris.meta.json: метаданные и столбцы эфемерид")
\ No newline at end of file
@@ -1,12 +1,31 @@
 import os
-import json
+import orjson
+import numpy as np
 from skyfield.api import load, wgs84
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from satellite_core import (
+    JSON_OPTIONS, TLE_CACHE_MAX_AGE_SEC,
+    propagate_and_detect_passes, quantize, write_json_lines
+)
+
+# Эфемериды хранятся целыми числами: значение = целое / масштаб
+EPHEMERIS_SCALE = {
+    "latitude": 10**6,
+    "longitude": 10**6,
+    "altitude_km": 1000,
+    "elevation": 1000,
+    "azimuth": 1000,
+    "distance_km": 1000
+}
 
 def get_tle(norad_id: int):
     url = f"https://celestrak.org/NORAD/elements/gp.php?CATNR={norad_id}"
+    filename = f"tle-{norad_id}.txt"
     try:
-        satellites = load.tle_file(url)
+        # Повторная загрузка только если копия на диске устарела
+        reload = load.exists(filename) and load.days_old(filename) >= TLE_CACHE_MAX_AGE_SEC / 86400
+        satellites = load.tle_file(url, reload=reload, filename=filename)
         if not satellites:
             raise ValueError(f"Спутник {norad_id} не найден")
         return satellites[0]
@@ -27,7 +46,6 @@ def calculate_and_save_data(
 ) -> None:
     # Загрузка данных
     satellite = get_tle(norad_id)
-    ts = load.timescale()
     observer = wgs84.latlon(observer_lat, observer_lon, observer_elev)
 
     # Метаданные
@@ -48,96 +66,112 @@ def calculate_and_save_data(
             "step_seconds": step_seconds,
             "min_elevation_deg": min_elevation,
             "utc_calculated": datetime.now(timezone.utc).isoformat()
-        }
+        },
+        "ephemeris_scale": EPHEMERIS_SCALE
     }
 
-    # Расчет пролетов
-    passes = []
-    ephemeris = []
-    current_pass = None
-    pass_number = 0
+    # Расчет позиций и пролетов сразу для всей сетки моментов времени
+    passes_columns, ephemeris_columns = propagate_and_detect_passes(
+        satellite, observer,
+        start_time_utc, end_time_utc, step_seconds,
+        min_elevation
+    )
+    pass_number = len(passes_columns["start"])
 
-    current_time = start_time_utc
-    while current_time <= end_time_utc:
-        t = ts.from_datetime(current_time)
-        try:
-            pos = satellite.at(t)
-            subpoint = pos.subpoint()
-            diff = pos - observer.at(t)
-            alt, az, dist = diff.altaz()
-           
-            if alt.degrees >= min_elevation:
-                if not current_pass:
-                    pass_number += 1
-                    current_pass = {
-                        "pass_id": pass_number,
-                        "start": current_time.isoformat(),
-                        "end": current_time.isoformat(),
-                        "max_elevation": round(alt.degrees, 2),
-                        "events": []
-                    }
-                else:
-                    current_pass["end"] = current_time.isoformat()
-                    current_pass["max_elevation"] = max(
-                        current_pass["max_elevation"],
-                        round(alt.degrees, 2)
-                    )
-
-                # Эфемериды
-                ephemeris_entry = {
-                    "pass_id": pass_number,
-                    "timestamp": current_time.isoformat(),
-                    "geodetic": {
-                        "latitude": round(subpoint.latitude.degrees, 6),
-                        "longitude": round(subpoint.longitude.degrees, 6),
-                        "altitude_km": round(subpoint.elevation.km, 3)
-                    },
-                    "topocentric": {
-                        "elevation": round(alt.degrees, 3),
-                        "azimuth": round(az.degrees, 3),
-                        "distance_km": round(dist.km, 3)
-                    }
-                }
-                ephemeris.append(ephemeris_entry)
-                current_pass["events"].append(ephemeris_entry)
-               
-            elif current_pass:
-                current_pass["duration_sec"] = round((
-                    datetime.fromisoformat(current_pass["end"]) -
-                    datetime.fromisoformat(current_pass["start"])
-                ).total_seconds(), 1)
-                passes.append(current_pass)
-                current_pass = None
-
-        except Exception as e:
-            print(f"Ошибка для {current_time}: {str(e)}")
-       
-        current_time += timedelta(seconds=step_seconds)
+    # Эфемериды по столбцам: имя поля пишется один раз, а не в каждой записи.
+    # Значения округляются до целых int32 в масштабе EPHEMERIS_SCALE
+    ephemeris = {
+        "pass_id": ephemeris_columns["pass_id"],
+        "timestamp": ephemeris_columns["timestamp"],
+        "latitude": quantize(ephemeris_columns["latitude"], EPHEMERIS_SCALE["latitude"]),
+        "longitude": quantize(ephemeris_columns["longitude"], EPHEMERIS_SCALE["longitude"]),
+        "altitude_km": quantize(ephemeris_columns["height_km"], EPHEMERIS_SCALE["altitude_km"]),
+        "elevation": quantize(ephemeris_columns["elevation"], EPHEMERIS_SCALE["elevation"]),
+        "azimuth": quantize(ephemeris_columns["azimuth"], EPHEMERIS_SCALE["azimuth"]),
+        "distance_km": quantize(ephemeris_columns["distance_km"], EPHEMERIS_SCALE["distance_km"])
+    }
 
-    # Фиксация последнего пролета
-    if current_pass:
-        current_pass["duration_sec"] = round((
-            datetime.fromisoformat(current_pass["end"]) -
-            datetime.fromisoformat(current_pass["start"])
-        ).total_seconds(), 1)
-        passes.append(current_pass)
+    # События пролета идут в столбцах эфемерид подряд
+    bounds = np.searchsorted(ephemeris["pass_id"], np.arange(1, pass_number + 2))
+    passes = [
+        {
+            "pass_id": pass_id,
+            "start": start,
+            "end": end,
+            "max_elevation": round(max_elevation, 2),
+            "events": {
+                name: column[bounds[pass_id - 1]:bounds[pass_id]]
+                for name, column in ephemeris.items()
+            },
+            "duration_sec": round(duration, 1)
+        }
+        for pass_id, (start, end, max_elevation, duration) in enumerate(
+            zip(passes_columns["start"], passes_columns["end"],
+                passes_columns["max_elevation"].tolist(), passes_columns["duration_sec"].tolist()),
+            start=1
+        )
+    ]
 
     # Сохранение в файлы
-    with open(passes_file, 'w') as f:
-        json.dump({
+    with open(passes_file, 'wb') as f:
+        f.write(orjson.dumps({
             "metadata": metadata,
             "statistics": {
                 "total_passes": pass_number,
                 "visible_time_total": sum(p["duration_sec"] for p in passes)
             },
             "passes": passes
-        }, f, indent = 2, ensure_ascii = False)
+        }, option=JSON_OPTIONS))
 
-    with open(ephemeris_file, 'w') as f:
-        json.dump({
-            "metadata": metadata,
-            "ephemeris": ephemeris
-        }, f, indent = 2, ensure_ascii = False)
+    # Эфемериды - в JSON Lines, метаданные - в соседний .meta.json
+    write_json_lines(ephemeris_file, metadata, ephemeris)
+
+def calculate_batch(
+    norad_ids: list,
+    observer_lat: float,
+    observer_lon: float,
+    start_time_utc: datetime,
+    end_time_utc: datetime,
+    step_seconds: int,
+    passes_file: str,
+    ephemeris_file: str,
+    observer_elev: float,
+    min_elevation: float
+) -> None:
+    # Имена файлов задаются шаблоном, например "passes_{norad_id}.json"
+    passes_files = [passes_file.format(norad_id=norad_id) for norad_id in norad_ids]
+    ephemeris_files = [ephemeris_file.format(norad_id=norad_id) for norad_id in norad_ids]
+
+    # Процессы не должны писать в один и тот же файл
+    if len(set(passes_files + ephemeris_files)) != 2 * len(norad_ids):
+        raise ValueError("Файлы спутников совпадают: шаблоны должны содержать {norad_id}, "
+                         "а номера NORAD не повторяться")
+
+    # TLE загружаются по очереди, чтобы не нагружать CelesTrak;
+    # процессы расчета затем берут их из кэша на диске
+    for norad_id in norad_ids:
+        get_tle(norad_id)
+
+    # Спутники независимы, поэтому каждый считается в отдельном процессе
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        futures = [
+            pool.submit(
+                calculate_and_save_data,
+                norad_id,
+                observer_lat,
+                observer_lon,
+                start_time_utc,
+                end_time_utc,
+                step_seconds,
+                passes_path,
+                ephemeris_path,
+                observer_elev,
+                min_elevation
+            )
+            for norad_id, passes_path, ephemeris_path in zip(norad_ids, passes_files, ephemeris_files)
+        ]
+        for future in futures:
+            future.result()
 
 # Для теста
 if __name__ == "__main__":
@@ -151,7 +185,7 @@ if __name__ == "__main__":
         end_time_utc = datetime(2025, 4, 26, 10, 0, tzinfo = timezone.utc),
         step_seconds = 60,
         passes_file = "passes.json",
-        ephemeris_file = "ephemeris.json",
+        ephemeris_file = "ephemeris.jsonl",
         observer_elev = 150,
         min_elevation = 10.0
     )
\ No newline at end of file